@@ -19,6 +19,6 @@ setup(
     packages=['transit_utils'],
     keywords='',
     author='Brian Jackson',
-    install_requires=['statsmodels', 'scipy', 'numpy', 'PyAstronomy'],
+    install_requires=['scipy', 'numpy>=1.20', 'PyAstronomy'],
     author_email='bjackson@boisestate.edu'
 )
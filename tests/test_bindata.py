@@ -0,0 +1,67 @@
+import numpy as np
+import pytest
+
+from transit_utils.transit_utils import bindata
+
+def test_bins_are_half_open():
+    """A point on a shared edge should only land in the later bin"""
+
+    time = np.array([0., 1., 2., 3.])
+    data = np.array([1., 3., 5., 9.])
+
+    binned_time, binned_data, binned_err = bindata(time, data, 2.,
+            times_to_try=np.array([1., 3.]), bin_calc='mean', err_calc='std')
+
+    np.testing.assert_array_equal(binned_time, [1., 3.])
+    np.testing.assert_allclose(binned_data, [2., 7.])
+    np.testing.assert_allclose(binned_err, [1./np.sqrt(2.), 2./np.sqrt(2.)])
+
+def test_mad_error():
+    time = np.array([0., 1., 2.])
+    data = np.array([1., 2., 4.])
+
+    _, binned_data, binned_err = bindata(time, data, 4.,
+            times_to_try=np.array([1.]))
+
+    np.testing.assert_allclose(binned_data, [2.])
+    np.testing.assert_allclose(binned_err, [1.4826/np.sqrt(3.)])
+
+def test_empty_bins_are_dropped():
+    time = np.array([0., 1., 2., 3.])
+    data = np.array([1., 3., 5., 9.])
+
+    binned_time, binned_data, _ = bindata(time, data, 2.,
+            times_to_try=np.array([1., 10., 3.]), bin_calc='mean')
+
+    np.testing.assert_array_equal(binned_time, [1., 3.])
+    np.testing.assert_allclose(binned_data, [2., 7.])
+
+def test_nan_data_and_times_are_dropped():
+    time = np.array([0., np.nan, 1., 2.])
+    data = np.array([1., 5., np.nan, 3.])
+
+    binned_time, binned_data, _ = bindata(time, data, 4.,
+            times_to_try=np.array([1.]), bin_calc='mean')
+
+    np.testing.assert_array_equal(binned_time, [1.])
+    np.testing.assert_allclose(binned_data, [2.])
+
+@pytest.mark.parametrize('err_calc', ['std', 'mad'])
+def test_zero_errors_become_one(err_calc):
+    """Bins of identical values, or of a single point, get an error of one"""
+
+    time = np.array([0., 1., 2.])
+    data = np.array([4., 4., 7.])
+
+    _, _, binned_err = bindata(time, data, 2.,
+            times_to_try=np.array([1., 3.]), err_calc=err_calc)
+
+    np.testing.assert_array_equal(binned_err, [1., 1.])
+
+@pytest.mark.parametrize('kwargs', [{'bin_calc': 'mode'},
+    {'err_calc': 'var'}])
+def test_bad_calc_raises(kwargs):
+    time = np.arange(4.)
+
+    with pytest.raises(ValueError):
+        bindata(time, time, 1., **kwargs)
@@ -0,0 +1,23 @@
+from types import SimpleNamespace
+
+import numpy as np
+
+import transit_utils.transit_utils as tu
+
+def test_masked_array_keeps_mask():
+    """Long masked arrays of times should skip the compiled kernel and come
+    back as masked arrays
+    """
+
+    params = SimpleNamespace(T0=0.3, per=1.7)
+    time = np.linspace(0., 1000., tu._NUMBA_PHI_MIN_LENGTH + 1)
+    mask = np.zeros(time.size, dtype=bool)
+    mask[::7] = True
+    masked_time = np.ma.masked_array(time, mask=mask)
+
+    phi = tu.calc_phi(masked_time, params)
+
+    assert isinstance(phi, np.ma.MaskedArray)
+    np.testing.assert_array_equal(phi.mask, mask)
+    np.testing.assert_allclose(phi.data[~mask],
+            ((time - 0.3) % 1.7)[~mask]/1.7)
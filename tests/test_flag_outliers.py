@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+
+import transit_utils.transit_utils as tu
+
+pytest.importorskip('numba')
+
+@pytest.mark.parametrize('outlier_group', range(1, 12))
+@pytest.mark.parametrize('length', [1, 2, 3, 7, 50, 5000, 40000])
+def test_kernel_matches_numpy_path(monkeypatch, outlier_group, length):
+    """The numba kernel and the NumPy path in flag_outliers should flag the
+    same points, including around NaNs and runs of tied values, and
+    where the kernel's parallel chunks meet
+    """
+
+    rng = np.random.default_rng(outlier_group*length)
+    data = rng.normal(size=length)
+    data[::53] += 20.
+    data[::211] = np.nan
+    data[10:17] = 1.
+    data[100:110] = np.round(data[100:110])
+
+    # Straddle each chunk boundary with a run of tied values and a NaN,
+    #   so the window rebuilt at the chunk start sees both, and put an
+    #   outlier just past them
+    for edge in range(tu._OUTLIER_CHUNK_LENGTH, length,
+            tu._OUTLIER_CHUNK_LENGTH):
+        data[edge - 6:edge + 6] = 2.
+        data[edge + 1] = np.nan
+        data[edge + 9] += 20.
+
+    # Force the NumPy path for the reference mask
+    monkeypatch.setattr(tu, '_NUMBA_OUTLIER_MIN_LENGTH', np.inf)
+    expected = tu.flag_outliers(data, outlier_group=outlier_group)
+
+    monkeypatch.setattr(tu, '_NUMBA_OUTLIER_MIN_LENGTH', 0)
+    result = tu.flag_outliers(data, outlier_group=outlier_group)
+
+    np.testing.assert_array_equal(result, expected)
@@ -1,13 +1,185 @@
-from statsmodels.robust.scale import mad
-from scipy.signal import medfilt
+from functools import lru_cache
+from math import asin, sqrt, pi
+from scipy.ndimage import median_filter
+from scipy.stats import binned_statistic
 import numpy as np
-from PyAstronomy.pyasl import isInTransit
+from numpy.lib.stride_tricks import sliding_window_view
 from PyAstronomy.modelSuite.XTran.forTrans import MandelAgolLC
 
+# numba is optional - without it, the kernels below run as plain Python
+try:
+    from numba import njit, prange
+    _HAS_NUMBA = True
+except ImportError:
+    _HAS_NUMBA = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        if((len(args) == 1) and callable(args[0])):
+            return args[0]
+        return lambda func: func
+
+# bottleneck is optional too - its nanmedian is much faster than NumPy's.
+#   Its nanmean sums float32 data without pairwise summation, so the mean
+#   stays with NumPy.
+from numpy import nanmean
+try:
+    from bottleneck import nanmedian
+except ImportError:
+    from numpy import nanmedian
+
 __all__ = ['calc_phi', 'calc_eclipse_time', 'transit_duration',
     'fit_eclipse_bottom', 'supersample_time', 'median_boxcar_filter',
     'bindata', 'flag_outliers', 'filter_data', 'fit_transit']
 
+_INV_PI = 1./pi
+
+# Scales a median absolute deviation to a Gaussian standard deviation
+_MAD_SCALE = 1.4826
+
+# Numerators under the square root in transit_duration, keyed by
+#   which_duration
+_DURATION_NUM = {
+    'full': lambda rp, b: (1. + rp)**2 - b**2,
+    'center': lambda rp, b: 1. - b**2,
+    'short': lambda rp, b: (1. - rp)**2 - b**2,
+}
+
+@lru_cache(maxsize=128)
+def _scalar_transit_duration(period, rp, b, sma, which_duration):
+    num = _DURATION_NUM[which_duration](rp, b)
+
+    # math functions skip NumPy's array dispatch for scalars; they raise
+    #   where NumPy would return NaN (e.g., short duration for a grazing
+    #   transit, or a zero semi-major axis)
+    try:
+        return np.float64(period*_INV_PI*asin(sqrt(num)/sma))
+    except (ValueError, ZeroDivisionError):
+        return np.float64(np.nan)
+
+def _median5(x):
+    """Median of each row of an (N, 5) array, using N. Devillard's
+    min/max sorting network for five elements
+    """
+
+    p0, p1, p2, p3, p4 = x.T
+    p0, p1 = np.minimum(p0, p1), np.maximum(p0, p1)
+    p3, p4 = np.minimum(p3, p4), np.maximum(p3, p4)
+    p3 = np.maximum(p0, p3)
+    p1 = np.minimum(p1, p4)
+    p1, p2 = np.minimum(p1, p2), np.maximum(p1, p2)
+    p2 = np.minimum(p2, p3)
+    return np.maximum(p1, p2)
+
+# Shortest time array for which calc_phi uses the compiled kernel - below
+#   this, launching the parallel kernel costs more than NumPy's ufuncs
+_NUMBA_PHI_MIN_LENGTH = 100000
+
+@njit(parallel=True, cache=True)
+def _calc_phi_kernel(time, T0, per):
+    phi = np.empty(time.size)
+    for i in prange(time.size):
+        phi[i] = ((time[i] - T0) % per)/per
+    return phi
+
+# Shortest series for which flag_outliers uses the compiled kernel
+_NUMBA_OUTLIER_MIN_LENGTH = 100000
+
+# Number of points each thread of _flag_outliers_kernel handles at a time
+_OUTLIER_CHUNK_LENGTH = 16384
+
+@njit(parallel=True, cache=True)
+def _flag_outliers_kernel(padded, outlier_group, num_std_desired):
+    """Rolling median/MAD outlier test over the edge-padded data, matching
+    the NumPy path in flag_outliers
+
+    Each chunk of the output slides a sorted copy of the window along the
+    data, so every step only removes one value and inserts another. The
+    MAD then comes from walking outward from the middle of the sorted
+    window. NaNs are kept out of the sorted window and counted instead.
+    """
+
+    k = outlier_group
+    n = padded.size - k + 1
+    half_group = k//2
+    ind = np.empty(n, dtype=np.bool_)
+
+    num_chunks = (n + _OUTLIER_CHUNK_LENGTH - 1)//_OUTLIER_CHUNK_LENGTH
+    for chunk in prange(num_chunks):
+        first = chunk*_OUTLIER_CHUNK_LENGTH
+        last = min(first + _OUTLIER_CHUNK_LENGTH, n)
+
+        window = np.empty(k)
+        num_valid = 0
+        num_nan = 0
+        for j in range(first, first + k):
+            if(np.isnan(padded[j])):
+                num_nan += 1
+            else:
+                window[num_valid] = padded[j]
+                num_valid += 1
+        window[:num_valid] = np.sort(window[:num_valid])
+
+        for i in range(first, last):
+            if(i > first):
+                # Drop the value leaving the window...
+                old = padded[i - 1]
+                if(np.isnan(old)):
+                    num_nan -= 1
+                else:
+                    j = np.searchsorted(window[:num_valid], old)
+                    for m in range(j, num_valid - 1):
+                        window[m] = window[m + 1]
+                    num_valid -= 1
+
+                # ...and insert the one entering it
+                new = padded[i + k - 1]
+                if(np.isnan(new)):
+                    num_nan += 1
+                else:
+                    j = np.searchsorted(window[:num_valid], new)
+                    for m in range(num_valid, j, -1):
+                        window[m] = window[m - 1]
+                    window[j] = new
+                    num_valid += 1
+
+            # A window containing a NaN has a NaN standard deviation and
+            #   is never flagged
+            if(num_nan > 0):
+                ind[i] = True
+                continue
+
+            med = 0.5*(window[(k - 1)//2] + window[k//2])
+
+            # Deviations grow moving outward from the middle of the sorted
+            #   window, so merging the two sides finds their median
+            left = (k - 1)//2
+            right = left + 1
+            lower_dev = 0.
+            dev = 0.
+            for count in range(k//2 + 1):
+                lower_dev = dev
+                if((right >= k) or
+                        ((left >= 0) and (med - window[left] <=
+                            window[right] - med))):
+                    dev = med - window[left]
+                    left -= 1
+                else:
+                    dev = window[right] - med
+                    right += 1
+            if(k % 2 == 1):
+                mad = dev
+            else:
+                mad = 0.5*(lower_dev + dev)
+
+            std = _MAD_SCALE*mad
+            num_std = 0.
+            if(std != 0.):
+                num_std = abs(padded[i + half_group] - med)/std
+            ind[i] = num_std < num_std_desired
+
+    return ind
+
 def calc_phi(time, params):
     """Calculates orbital phase assuming zero eccentricity
 
@@ -24,6 +196,14 @@ def calc_phi(time, params):
     T0 = params.T0
     per = params.per
 
+    # The compiled kernel only pays off for long float64 arrays of times.
+    #   Subclasses (masked arrays, Quantities) keep the NumPy expression.
+    if(_HAS_NUMBA and (type(time) is np.ndarray) and
+            (time.size >= _NUMBA_PHI_MIN_LENGTH) and
+            (time.dtype == np.float64) and
+            (np.ndim(T0) == 0) and (np.ndim(per) == 0)):
+        return _calc_phi_kernel(time.ravel(), T0, per).reshape(time.shape)
+
     return ((time - T0) % per)/per
 
 def calc_eclipse_time(params):
@@ -76,14 +256,18 @@ def transit_duration(params, which_duration="full"):
         b = params.b
         sma = params.a
 
-    if(which_duration == "full"):
-        return period/np.pi*np.arcsin(np.sqrt((1. + rp)**2 - b**2)/sma)
-    elif(which_duration == "center"):
-        return period/np.pi*np.arcsin(np.sqrt(1. - b**2)/sma)
-    elif(which_duration == "short"):
-        return period/np.pi*np.arcsin(np.sqrt((1. - rp)**2 - b**2)/sma)
-    else:
-        raise ValueError("which_duration must be 'full', 'center', 'short'!")
+    try:
+        num_func = _DURATION_NUM[which_duration]
+    except (KeyError, TypeError):
+        raise ValueError(
+                "which_duration must be 'full', 'center', 'short'!") from None
+
+    # Scalar geometries repeat during a fit, so they go through the cache;
+    #   arrays are unhashable and fall through to NumPy
+    try:
+        return _scalar_transit_duration(period, rp, b, sma, which_duration)
+    except TypeError:
+        return period/np.pi*np.arcsin(np.sqrt(num_func(rp, b))/sma)
 
 def fit_eclipse_bottom(time, data, params, zero_eclipse_method="mean"):
     """Calculates the eclipse bottom to set the zero-point in the data
@@ -107,9 +291,9 @@ def fit_eclipse_bottom(time, data, params, zero_eclipse_method="mean"):
     """
 
     if(zero_eclipse_method == "mean"):
-        calc_method = np.nanmean
+        calc_method = nanmean
     elif(zero_eclipse_method == "median"):
-        calc_method = np.nanmedian
+        calc_method = nanmedian
     else:
         raise ValueError("which_method should be mean or median!")
 
@@ -117,22 +301,23 @@ def fit_eclipse_bottom(time, data, params, zero_eclipse_method="mean"):
     period = params.per
     TE = calc_eclipse_time(params)
 
+    # Fold time about mid-eclipse to find in-eclipse points
+    folded_time = ((time - TE + 0.5*period) % period) - 0.5*period
+
     # In some cases, the planet is never totally occulted.
     #   For those cases, fit eclipse with quadratic and return min value.
     if((1. - params.p)**2 - params.b**2. < 0.):
-        # Find in-eclipse points
         dur = transit_duration(params, which_duration='full')
-        ind = isInTransit(time, TE, period, 0.5*dur, boolOutput=True)
+        ind = np.abs(folded_time) <= 0.5*dur
 
         # Fit quadratic to eclipse to estimate minimum
         coeffs = np.polyfit(time[ind], data[ind], 2)
         eclipse_bottom = np.polyval(coeffs, -coeffs[1]/2./coeffs[0])
 
     else:
-        # Find in-eclipse points
         dur = transit_duration(params, which_duration='short')
+        ind = np.abs(folded_time) <= 0.5*dur
 
-        ind = isInTransit(time, TE, period, 0.5*dur, boolOutput=True)
         eclipse_bottom = calc_method(data[ind])
 
     return eclipse_bottom
@@ -152,8 +337,11 @@ def supersample_time(time, supersample_factor, exp_time):
     if supersample_factor > 1:
         time_offsets = np.linspace(-exp_time/2., exp_time/2., 
                 supersample_factor)
-        time_supersample = (time_offsets +\
-                time.reshape(time.size, 1)).flatten()
+        # Add the offsets straight into the output array - reshaping the
+        #   freshly allocated array is a view, so nothing is copied
+        time_supersample = np.empty(time.size*supersample_factor)
+        np.add(time.reshape(time.size, 1), time_offsets,
+                out=time_supersample.reshape(time.size, supersample_factor))
     else: 
         time_supersample = time
 
@@ -187,30 +375,26 @@ def median_boxcar_filter(time, data, window_length=None, endpoints='reflect',
         The filter array
     """
 
-    filter_array = np.copy(data)
-    # Create filter array
+    # Create filter array - median_filter does not modify its input, so
+    #   the data only need copying if masked points will be overwritten
+    filter_array = data
     if(endpoints == 'reflect'):
-        last_index = len(data) - 1
-
         # If mask_ind provided, interpolate across the masked points
         if(mask_ind is not None):
+            filter_array = np.copy(data)
             not_mask_ind = ~mask_ind
             filter_array[mask_ind] = np.interp(time[mask_ind],
                     time[not_mask_ind], filter_array[not_mask_ind])
-            
-        filter_array =\
-                np.concatenate((np.flip(filter_array[0:2*window_length], 0),
-                    filter_array,
-                    filter_array[last_index - 2*window_length:last_index]))
 
-        # Make filter
+        # Make filter - median_filter reflects the data about the endpoints
+        #   itself, so no padded copy of the array is needed.
         # Check that window_length is odd
         if(window_length % 2 == 0):
-            filt = medfilt(filter_array, window_length+1)
+            filt = median_filter(filter_array, size=window_length+1,
+                    mode='reflect')
         else:
-            filt = medfilt(filter_array, window_length)
-
-        filt = filt[2*window_length:2*window_length + last_index + 1]
+            filt = median_filter(filter_array, size=window_length,
+                    mode='reflect')
 
     return filt
 
@@ -247,44 +431,76 @@ def bindata(time, data, binsize,
     binned_err : numpy array
     """
 
+    if(bin_calc not in ('mean', 'median')):
+        raise ValueError("bin_calc should be mean or median!")
+    if(err_calc not in ('std', 'mad')):
+        raise ValueError("err_calc should be std or mad!")
+
     # 2018 May 23 - There are not always points in each time bin,
     #   so we will TRY to find points but will not always find them.
     if(times_to_try is None):
-        times_to_try = np.arange(np.min(time) + 0.5*binsize, 
-                np.max(time) - 0.5*binsize, binsize)
-
-    binned_time = np.array([])
-    binned_data = np.array([])
-    binned_err = np.array([])
+        times_to_try = np.arange(np.nanmin(time) + 0.5*binsize, 
+                np.nanmax(time) - 0.5*binsize, binsize)
+    times_to_try = np.asarray(times_to_try)
+
+    # Drop points with NaN data or times and sort by time once (light
+    #   curves usually are sorted already), so that each bin is a
+    #   contiguous slice whose boundaries come straight from searchsorted
+    not_nan_ind = ~np.isnan(data) & ~np.isnan(time)
+    time = time[not_nan_ind]
+    data = data[not_nan_ind]
+    if(np.any(time[1:] < time[:-1])):
+        order = np.argsort(time, kind='stable')
+        time = time[order]
+        data = data[order]
+
+    starts = np.searchsorted(time, times_to_try - 0.5*binsize)
+    ends = np.searchsorted(time, times_to_try + 0.5*binsize)
+    filled = ends > starts
+    starts = starts[filled]
+    ends = ends[filled]
+    num_points = ends - starts
+
+    binned_time = times_to_try[filled]
+    if(binned_time.size == 0):
+        return binned_time, np.array([]), np.array([])
+
+    # Gather the points of every bin end to end, labeled by bin. Means and
+    #   standard deviations come from np.bincount; binned_statistic is
+    #   only needed for the medians.
+    num_bins = len(num_points)
+    bin_ind = np.repeat(np.arange(num_bins), num_points)
+    offsets = np.cumsum(num_points) - num_points
+    cur_data = data[np.arange(np.sum(num_points)) +
+            (starts - offsets)[bin_ind]]
+    bin_edges = np.arange(num_bins + 1)
+
+    if((bin_calc == 'mean') or (err_calc == 'std')):
+        means = np.bincount(bin_ind, weights=cur_data,
+                minlength=num_bins)/num_points
+
+    if((bin_calc == 'median') or (err_calc == 'mad')):
+        medians = binned_statistic(bin_ind, cur_data,
+                statistic='median', bins=bin_edges).statistic
 
     if(bin_calc == 'median'):
-        bin_calc_func = np.nanmedian
+        binned_data = medians
     elif(bin_calc == 'mean'):
-        bin_calc_func = np.nanmean
+        binned_data = means
 
     if(err_calc == 'mad'):
-        err_calc_func = lambda x : mad(x)/np.sqrt(len(x))
+        abs_dev = np.abs(cur_data - medians[bin_ind])
+        binned_err = _MAD_SCALE*binned_statistic(bin_ind, abs_dev,
+                statistic='median', bins=bin_edges).statistic
     elif(err_calc == 'std'):
-        err_calc_func = lambda x : np.nanstd(x)/np.sqrt(len(x))
-
-    for i in range(len(times_to_try)):
-        ind = np.argwhere(np.abs(times_to_try[i] - time) <= binsize)
-
-        if(ind.size > 0): 
-            # Remove nans, too
-            cur_time = time[ind[~np.isnan(data[ind])]]
-            cur_data = data[ind[~np.isnan(data[ind])]]
-            
-            if(cur_data.size > 0):
-                binned_time = np.append(binned_time, times_to_try[i])
-                binned_data = np.append(binned_data, bin_calc_func(cur_data))
-
-                # Check for bad error value
-                try_error = err_calc_func(cur_data)
-                if(try_error == 0.):
-                    binned_err = np.append(binned_err, 1.)
-                else:
-                    binned_err = np.append(binned_err, err_calc_func(cur_data))
+        sq_dev = np.bincount(bin_ind, weights=(cur_data - means[bin_ind])**2,
+                minlength=num_bins)
+        binned_err = np.sqrt(sq_dev/num_points)
+
+    binned_err /= np.sqrt(num_points)
+
+    # Check for bad error value
+    binned_err[binned_err == 0.] = 1.
 
     return binned_time, binned_data, binned_err
 
@@ -297,8 +513,8 @@ def flag_outliers(data, outlier_group=5, num_std_desired=10.):
     data : array
         ordered data array
     outlier_group : int, optional
-        number of datapoints to group together in calculating standard
-        deviation; defaults to 5
+        number of datapoints in the sliding window used to calculate the
+        median and standard deviation around each point; defaults to 5
     num_std_desired : float, optional
         number of standard deviations beyond which to declare an outlier
 
@@ -307,41 +523,54 @@ def flag_outliers(data, outlier_group=5, num_std_desired=10.):
     mask of non-outlier points
     """
 
-    # Pad out data array to have outlier_group x N number of elements
-    num_extra_elements = outlier_group - (len(data) % outlier_group)
-
-    copy_data = np.append(data, np.zeros(num_extra_elements))
+    # Work in floats so integer data can hold the fractional statistics
+    data = np.asarray(data, dtype=float)
+    if(len(data) == 0):
+        return np.ones(0, dtype=bool)
+
+    # Pad both ends with the end values so that each point sits at the
+    #   center of its own window
+    half_group = outlier_group//2
+    padded = np.pad(data, (half_group, outlier_group - 1 - half_group),
+            mode='edge')
+
+    # For long series, the compiled kernel slides a sorted window along
+    #   the data instead of working on every window separately
+    if(_HAS_NUMBA and (len(data) > _NUMBA_OUTLIER_MIN_LENGTH)):
+        return _flag_outliers_kernel(padded, outlier_group,
+                num_std_desired)
+
+    # Otherwise, view the windows without copying
+    windows = sliding_window_view(padded, outlier_group)
+
+    # A window containing a NaN gets a NaN standard deviation and is
+    #   never flagged, so a plain median does as well as nanmedian. For
+    #   the default windows of five, a sorting network is faster still.
+    if(outlier_group == 5):
+        window_median = _median5
+    else:
+        window_median = lambda x: np.median(x, axis=1)
 
-    # Using the outer product makes outlier_group copies of each standard 
-    # deviation and median, allowing me to compare to each data point
-    std = np.outer(mad(copy_data.reshape(-1, 5), axis=1),
-            np.ones(outlier_group))
-    med = np.outer(np.nanmedian(copy_data.reshape(-1, 5), axis=1),
-        np.ones(outlier_group))
+    med = window_median(windows)
+    std = _MAD_SCALE*window_median(np.abs(windows - med[:, None]))
 
     # Check for NaN and zeros
     not_nan_ind = ~np.isnan(std) & (std != 0)
     num_std = np.zeros_like(med)
-    num_std[not_nan_ind] =\
-            abs(((copy_data.reshape(-1, 5))[not_nan_ind] -
-                med[not_nan_ind])/std[not_nan_ind])
-    num_std = num_std.flatten()
+    np.divide(np.abs(data - med), std, out=num_std, where=not_nan_ind)
 
     ind = num_std < num_std_desired
 
-    # Unpad index array
-    ind = ind[0:len(data)]
-
     return ind
 
 def filter_data(cur_time, cur_flux,
     num_periods=4, drop_outliers=False, params=None):
 
-    saved_median = np.nanmedian(cur_flux)
+    saved_median = nanmedian(cur_flux)
     cur_flux = (cur_flux - saved_median)/saved_median
 
     window = num_periods*params['per']
-    del_t = np.nanmedian(cur_time[1:] - cur_time[:-1])
+    del_t = nanmedian(cur_time[1:] - cur_time[:-1])
     window_length = int(window/del_t)
 
     # Indicate all points in transit